@@ -1,3 +1,4 @@
+from functools import lru_cache
 from typing import Optional
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -13,5 +14,6 @@ class Settings(BaseSettings):
     gemini_model: str = "models/gemini-2.0-flash"  # env: GEMINI_MODEL
 
 
+@lru_cache(maxsize=1)
 def get_settings() -> Settings:
     return Settings()
@@ -1,6 +1,8 @@
+from functools import lru_cache
 from typing import Any, Dict, List
 
 
+@lru_cache(maxsize=1)
 def gemini_function_declarations() -> List[Dict[str, Any]]:
     return [
         {
@@ -1,12 +1,21 @@
-from typing import Any, Dict, List
+import heapq
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
 from datetime import datetime
 
 from third_party.openfda.client import OpenFDAClient
-from third_party.openfda.transforms import normalize_recall
-from utils.logger import get_logger, kv_message as kv
+from third_party.openfda.transforms import normalize_recall_projected, sum_time_buckets_by_year
+from utils.logger import get_logger, kv_message as kv, kv_message_ordered as kv_ordered
 
 logger = get_logger(__name__)
 
+# Independent openFDA queries behind one stats call run concurrently on this pool
+_STATS_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="openfda-stats")
+
+
+def _bucket_count(bucket: Dict[str, Any]) -> int:
+    return int(bucket.get("count", 0) or 0)
+
 
 def search_recalls_handler(args: Dict[str, Any], client: OpenFDAClient) -> Dict[str, Any]:
     query = args.get("query")
@@ -32,15 +41,14 @@ def search_recalls_handler(args: Dict[str, Any], client: OpenFDAClient) -> Dict[
     skip = int(args.get("skip", 0) or 0)
     sort = args.get("sort")
     fields = args.get("fields")  # optional projection
-    logger.info(kv("search_recalls start", query=query, firm=firm, classification=classification, limit=limit, skip=skip, sort=sort))
+    logger.info(kv_ordered("search_recalls start", (
+        ("query", query), ("firm", firm), ("classification", classification),
+        ("limit", limit), ("skip", skip), ("sort", sort),
+    )))
     data = client.search_enforcements(query=query, classification=classification, limit=limit, skip=skip, sort=sort)
     results = data.get("results", []) or []
-    normalized = [normalize_recall(r) for r in results]
-    if isinstance(fields, list) and fields:
-        filtered: List[Dict[str, Any]] = []
-        for item in normalized:
-            filtered.append({k: v for k, v in item.items() if k in fields})
-        normalized = filtered
+    field_set = frozenset(fields) if isinstance(fields, list) and fields else None
+    normalized = [normalize_recall_projected(r, field_set) for r in results]
     logger.info(kv("search_recalls done", results=len(normalized)))
     return {"recalls": normalized, "meta": data.get("meta", {})}
 
@@ -49,32 +57,58 @@ def get_recall_stats_handler(args: Dict[str, Any], client: OpenFDAClient) -> Dic
     stats_requested: List[str] = args.get("stats") or []
     # Normalize values
     stats_requested = [s for s in stats_requested if isinstance(s, str)]
-    include_total = "total" in stats_requested
-    include_class = "byClassification" in stats_requested
-    include_top_firms = "topFirms" in stats_requested
-    include_bottom_firms = "bottomFirms" in stats_requested
-    include_by_year = "byYear" in stats_requested or "mostYear" in stats_requested or "leastYear" in stats_requested
-    include_firm_total = "firmTotal" in stats_requested
+    requested = frozenset(stats_requested)
+    include_total = "total" in requested
+    include_class = "byClassification" in requested
+    include_top_firms = "topFirms" in requested
+    include_bottom_firms = "bottomFirms" in requested
+    include_by_year = "byYear" in requested or "mostYear" in requested or "leastYear" in requested
+    include_firm_total = "firmTotal" in requested
     classification_filter = (args.get("classification") or "").strip()
 
     result: Dict[str, Any] = {}
-    logger.info(kv("get_recall_stats start", stats=stats_requested, classification=classification_filter))
+    logger.info(kv_ordered("get_recall_stats start", (("stats", stats_requested), ("classification", classification_filter))))
+
+    # Year window for byYear/mostYear/leastYear; defaults to the last 10 years
+    start_year = args.get("startYear")
+    end_year = args.get("endYear")
+    if not isinstance(start_year, int) or not isinstance(end_year, int) or start_year > end_year:
+        end_year = datetime.utcnow().year
+        start_year = end_year - 9
+
+    # Submit every query the requested stats need up front; results are collected below
+    firm = (args.get("firm") or "").strip()
+    firm_total_future: Optional[Future] = None
+    if include_firm_total and firm:
+        parts = [f'recalling_firm:"{firm}"']
+        if classification_filter:
+            parts.append(f'classification:"{classification_filter}"')
+        firm_total_future = _STATS_POOL.submit(client.search_enforcements, query=" AND ".join(parts), limit=1, skip=0)
+    class_future: Optional[Future] = None
+    if include_class or include_total:
+        class_future = _STATS_POOL.submit(client.count_buckets, "classification")
+    firm_buckets_future: Optional[Future] = None
+    if include_top_firms or include_bottom_firms:
+        search_clause = None
+        if classification_filter:
+            search_clause = f'classification:"{classification_filter}"'
+        firm_buckets_future = _STATS_POOL.submit(client.count_buckets, "recalling_firm", search=search_clause)
+    year_future: Optional[Future] = None
+    if include_by_year:
+        # One daily time-series count over the whole range, folded into years locally
+        search = f"recall_initiation_date:[{start_year}0101 TO {end_year}1231]"
+        year_future = _STATS_POOL.submit(client.count_buckets, "recall_initiation_date", search=search, exact=False)
 
     # firmTotal
     if include_firm_total:
-        firm = (args.get("firm") or "").strip()
-        if firm:
-            parts = [f'recalling_firm:"{firm}"']
-            if classification_filter:
-                parts.append(f'classification:"{classification_filter}"')
-            query = " AND ".join(parts)
-            data = client.search_enforcements(query=query, limit=1, skip=0)
+        if firm_total_future is not None:
+            data = firm_total_future.result()
             meta = (data or {}).get("meta", {})
             total = int(((meta.get("results") or {}).get("total")) or 0)
             result["firmTotal"] = total
             result["firm"] = firm
             # Early return if only firmTotal requested
-            if set(stats_requested) == {"firmTotal"}:
+            if requested == {"firmTotal"}:
                 logger.info(kv("get_recall_stats firmTotal only", firm=firm, total=total))
                 return result
         else:
@@ -83,7 +117,8 @@ def get_recall_stats_handler(args: Dict[str, Any], client: OpenFDAClient) -> Dic
     # byClassification and/or total
     recalls_by_classification: Dict[str, int] = {}
     if include_class or include_total:
-        classification_buckets = client.count_buckets("classification")
+        assert class_future is not None
+        classification_buckets = class_future.result()
         recalls_by_classification = {b.get("term", "") or "Unknown": int(b.get("count", 0) or 0) for b in classification_buckets}
         if include_class:
             result["recallsByClassification"] = recalls_by_classification
@@ -96,61 +131,46 @@ def get_recall_stats_handler(args: Dict[str, Any], client: OpenFDAClient) -> Dic
         limit = max(1, min(limit, 10))
         bottom_limit = int(args.get("bottomFirmsLimit", limit) or limit)
         bottom_limit = max(1, min(bottom_limit, 10))
-        search_clause = None
-        if classification_filter:
-            search_clause = f'classification:"{classification_filter}"'
-        firm_buckets = client.count_buckets("recalling_firm", search=search_clause)
+        assert firm_buckets_future is not None
+        firm_buckets = firm_buckets_future.result()
         # top
         if include_top_firms:
             top_firms: List[Dict[str, Any]] = []
             for b in firm_buckets[:limit]:
                 term = b.get("term", "") or "Unknown"
-                count = int(b.get("count", 0) or 0)
-                top_firms.append({"firm": term, "count": count})
+                top_firms.append({"firm": term, "count": _bucket_count(b)})
             result["topFirms"] = top_firms
         # bottom (ascending)
         if include_bottom_firms:
-            sorted_asc = sorted(
-                [{"firm": (b.get("term", "") or "Unknown"), "count": int(b.get("count", 0) or 0)} for b in firm_buckets],
-                key=lambda x: x["count"]
-            )
-            bottom = [b for b in sorted_asc if b["count"] > 0][:bottom_limit]
-            result["bottomFirms"] = bottom
+            # k-smallest via a heap; only the survivors become {firm, count} dicts
+            smallest = heapq.nsmallest(bottom_limit, (b for b in firm_buckets if _bucket_count(b) > 0), key=_bucket_count)
+            result["bottomFirms"] = [{"firm": (b.get("term", "") or "Unknown"), "count": _bucket_count(b)} for b in smallest]
 
     # byYear / mostYear / leastYear
     if include_by_year:
-        start_year = args.get("startYear")
-        end_year = args.get("endYear")
-        this_year = datetime.utcnow().year
-        if not isinstance(start_year, int) or not isinstance(end_year, int) or start_year > end_year:
-            start_year = this_year - 9
-            end_year = this_year
-        recalls_by_year: Dict[str, int] = {}
-        for year in range(start_year, end_year + 1):
-            search = f"recall_initiation_date:[{year}0101 TO {year}1231]"
-            try:
-                data = client.search_enforcements(query=search, limit=1)
-                meta = (data or {}).get("meta", {})
-                total = ((meta.get("results") or {}).get("total")) or 0
-                recalls_by_year[str(year)] = int(total)
-            except Exception:
-                recalls_by_year[str(year)] = 0
-        if "byYear" in stats_requested:
+        assert year_future is not None
+        try:
+            year_counts = sum_time_buckets_by_year(year_future.result())
+        except Exception:
+            year_counts = {}
+        recalls_by_year: Dict[str, int] = {str(year): year_counts.get(str(year), 0) for year in range(start_year, end_year + 1)}
+        if "byYear" in requested:
             result["recallsByYear"] = recalls_by_year
-        if "mostYear" in stats_requested and recalls_by_year:
+        if "mostYear" in requested and recalls_by_year:
             most_year = max(recalls_by_year.items(), key=lambda kv: kv[1])
             result["mostYear"] = {"year": most_year[0], "count": most_year[1]}
-        if "leastYear" in stats_requested and recalls_by_year:
+        if "leastYear" in requested and recalls_by_year:
             least_year = min(recalls_by_year.items(), key=lambda kv: kv[1])
             result["leastYear"] = {"year": least_year[0], "count": least_year[1]}
 
-    logger.info(kv("get_recall_stats done",
-                   include_total=include_total,
-                   include_class=include_class,
-                   include_top_firms=include_top_firms,
-                   include_bottom_firms=include_bottom_firms,
-                   include_by_year=include_by_year,
-                   include_firm_total=include_firm_total))
+    logger.info(kv_ordered("get_recall_stats done", (
+        ("include_total", include_total),
+        ("include_class", include_class),
+        ("include_top_firms", include_top_firms),
+        ("include_bottom_firms", include_bottom_firms),
+        ("include_by_year", include_by_year),
+        ("include_firm_total", include_firm_total),
+    )))
     return result
 
 
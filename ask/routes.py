@@ -1,16 +1,20 @@
+import json
+from typing import Iterator
+
 from fastapi import APIRouter, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
 
 from app.config import get_settings
+from app.responses import ORJSONResponse
 from ask.schemas import AskRequest
-from ask.services import run_conversation_with_gemini
+from ask.services import run_conversation_with_gemini, stream_conversation_with_gemini
 
 
 router = APIRouter()
 
 
 @router.post("/ask")
-def ask(body: AskRequest):
+async def ask(body: AskRequest):
     question = (body.question or "").strip()
     if not question:
         raise HTTPException(status_code=400, detail="Missing 'question'")
@@ -18,9 +22,32 @@ def ask(body: AskRequest):
         settings = get_settings()
         if not settings.gemini_api_key:
             raise HTTPException(status_code=400, detail="GEMINI_API_KEY not set")
-        result = run_conversation_with_gemini(question)
-        return JSONResponse(result)
+        result = await run_conversation_with_gemini(question)
+        return ORJSONResponse(result)
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
 
 
+@router.post("/ask/stream")
+async def ask_stream(body: AskRequest):
+    question = (body.question or "").strip()
+    if not question:
+        raise HTTPException(status_code=400, detail="Missing 'question'")
+    settings = get_settings()
+    if not settings.gemini_api_key:
+        raise HTTPException(status_code=400, detail="GEMINI_API_KEY not set")
+
+    # Sync generator: Starlette iterates it in a worker thread, so blocking Gemini/openFDA calls stay off the loop
+    def token_stream() -> Iterator[str]:
+        try:
+            for event in stream_conversation_with_gemini(question):
+                yield f"data: {json.dumps(event)}\n\n"
+        except Exception as exc:
+            yield f"data: {json.dumps({'error': str(exc)})}\n\n"
+
+    return StreamingResponse(
+        token_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
@@ -1,4 +1,7 @@
-from typing import Any, Dict, Optional
+import asyncio
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from datetime import datetime, timedelta
 import re
 import google.generativeai as genai
@@ -7,16 +10,80 @@ from google.ai.generativelanguage_v1beta.types import content as glm_content
 from app.config import get_settings
 from ask.function_tools import get_recall_stats_handler, search_recalls_handler
 from third_party.openfda.client import OpenFDAClient
-from utils.logger import get_logger, kv_message as kv
+from utils.logger import get_logger, kv_message as kv, kv_message_ordered as kv_ordered
 
 logger = get_logger(__name__)
 
+_FIRM_LIST_RE = re.compile(r'(?:recalls\s+for\s+firm|list\s+(?:all\s+)?recalls\s+for\s+firm)\s+(.+)')
+# Any question that can trigger a call rewrite in _rewrite_call matches this
+_REWRITE_TRIGGER_RE = re.compile(r'how many|least|fewest|recalls\s+for\s+firm')
+_TOP_FIRMS_KWS = frozenset({"which firms", "top firms", "most recalls", "who has the most"})
+_STOPWORDS = frozenset({"is", "are", "exists", "for", "of", "the"})
 
-def run_conversation_with_gemini(question: str) -> Dict[str, Any]:
-    settings = get_settings()
-    if not settings.gemini_api_key:
-        raise RuntimeError("GEMINI_API_KEY not set")
-    genai.configure(api_key=settings.gemini_api_key)
+
+@dataclass(frozen=True, slots=True)
+class _QuestionInfo:
+    lower: str
+    class_label: Optional[str]
+    firm_name: str
+    last_n: Optional[int]
+    last_unit: str
+    is_firm_total: bool
+    is_least: bool
+    firm_list_name: Optional[str]
+    is_rewrite_candidate: bool
+
+
+def _parse_question(question: str) -> _QuestionInfo:
+    """Lowercase and tokenize the question once; every intent check reads from the result."""
+    uq = (question or "").lower()
+    # map numeric class to label
+    class_label = None
+    if "classification" in uq:
+        if " 1" in uq or " class 1" in uq or "class i" in uq:
+            class_label = "Class I"
+        elif " 2" in uq or " class 2" in uq or "class ii" in uq:
+            class_label = "Class II"
+        elif " 3" in uq or " class 3" in uq or "class iii" in uq:
+            class_label = "Class III"
+    # naive extract text after 'firm', dropping filler words like 'is', 'are', 'exists'
+    firm_name = ""
+    if "firm" in uq:
+        tokens = [t for t in uq.split("firm", 1)[1].split() if t not in _STOPWORDS]
+        firm_name = " ".join(tokens).strip().strip('"\'')
+    # crude parse for "last/past N day(s)/week(s)/month(s)"
+    last_n: Optional[int] = None
+    last_unit = "days"
+    keyword = "last" if "last" in uq else "past" if "past" in uq else None
+    if keyword:
+        tokens = uq.split(keyword, 1)[1].split()
+        try:
+            if tokens and tokens[0].isdigit():
+                last_n = int(tokens[0])
+                last_unit = tokens[1] if len(tokens) > 1 else "days"
+            elif tokens:
+                last_unit = tokens[0]
+        except ValueError:
+            last_n = None
+    is_rewrite_candidate = _REWRITE_TRIGGER_RE.search(uq) is not None
+    firm_list_match = _FIRM_LIST_RE.search(uq) if is_rewrite_candidate else None
+    return _QuestionInfo(
+        lower=uq,
+        class_label=class_label,
+        firm_name=firm_name,
+        last_n=last_n,
+        last_unit=last_unit,
+        is_firm_total="how many" in uq and "firm" in uq,
+        is_least="least" in uq or "fewest" in uq,
+        firm_list_name=firm_list_match.group(1).strip().strip('"\'') if firm_list_match else None,
+        is_rewrite_candidate=is_rewrite_candidate,
+    )
+
+
+@lru_cache(maxsize=1)
+def _get_model(api_key: str, model_name: str) -> genai.GenerativeModel:
+    """Configure genai and bind the static tools/system prompt once per (key, model) per process."""
+    genai.configure(api_key=api_key)
 
     from ask.function_schemas import gemini_function_declarations
 
@@ -24,8 +91,8 @@ def run_conversation_with_gemini(question: str) -> Dict[str, Any]:
     # available_model_names = [f'{m.name} - {m.supported_generation_methods}' for m in available_models]
     # print("Available models", available_model_names)
     
-    model = genai.GenerativeModel(
-        model_name=settings.gemini_model,
+    return genai.GenerativeModel(
+        model_name=model_name,
         tools=[{"function_declarations": gemini_function_declarations()}],
         system_instruction=(
             "You are an assistant that answers questions about FDA drug recalls using the openFDA "
@@ -44,198 +111,243 @@ def run_conversation_with_gemini(question: str) -> Dict[str, Any]:
         ),
     )
 
-    chat = model.start_chat()
+
+def _start_chat() -> Any:
+    settings = get_settings()
+    if not settings.gemini_api_key:
+        raise RuntimeError("GEMINI_API_KEY not set")
+    return _get_model(settings.gemini_api_key, settings.gemini_model).start_chat()
+
+
+def _call_tool(client: OpenFDAClient, name: str, args: Dict[str, Any]) -> Dict[str, Any]:
+    logger.info(kv_ordered("tool_call", (("name", name), ("args", args))))
+    if name == "search_recalls":
+        return search_recalls_handler(args, client)
+    if name == "get_recall_stats":
+        return get_recall_stats_handler(args, client)
+    return {"error": f"Unknown tool: {name}"}
+
+
+def _function_calls(response: Any) -> List[Any]:
+    parts: List[Any] = []
+    if response and response.candidates:
+        parts = response.candidates[0].content.parts or []
+    return [p.function_call for p in parts if getattr(p, "function_call", None)]
+
+
+def _chunk_text(chunk: Any) -> str:
+    # chunk.text raises on function-call chunks, so read the text parts directly
+    if not chunk.candidates:
+        return ""
+    return "".join(getattr(p, "text", "") or "" for p in chunk.candidates[0].content.parts or [])
+
+
+def _rewrite_call(info: _QuestionInfo, fc: Any) -> Tuple[str, Dict[str, Any]]:
+    """Intercept misrouted calls based on intent and rewrite appropriately."""
+    name = fc.name
+    args = dict(fc.args) if hasattr(fc, "args") else {}
+    if not info.is_rewrite_candidate:
+        return name, args
+    if name == "get_recall_stats" and info.is_firm_total:
+        args = {"stats": ["firmTotal"], "firm": info.firm_name or (args.get("firm") or "")}
+        if info.class_label:
+            args["classification"] = info.class_label
+    # least/fewest → bottomFirms (force even if model tried something else)
+    if info.is_least:
+        name = "get_recall_stats"
+        args = {"stats": ["bottomFirms"], "bottomFirmsLimit": 10}
+        if info.class_label:
+            args["classification"] = info.class_label
+    # If user asked to list recalls for a firm, force search_recalls with firm filter (regex with word boundary)
+    if info.firm_list_name is not None:
+        name = "search_recalls"
+        args = {"firm": info.firm_list_name, "limit": 50, "sort": "recall_initiation_date:desc"}
+    return name, args
+
+
+def _tool_message(name: str, payload: Dict[str, Any]) -> glm_content.Content:
+    return glm_content.Content(
+        role="tool",
+        parts=[
+            glm_content.Part(
+                function_response=glm_content.FunctionResponse(
+                    name=name,
+                    response=payload,
+                )
+            )
+        ],
+    )
+
+
+def _fallback_kind(info: _QuestionInfo) -> Optional[str]:
+    """Name of the heuristic fallback that applies to this question, or None; checked in priority order."""
+    user_q = info.lower
+    if ("last" in user_q) and ("recall" in user_q):
+        return "last_recalls"
+    if (("list" in user_q or "recalls for firm" in user_q or "list all recalls" in user_q) and "firm" in user_q):
+        return "firm_list"
+    if any(kw in user_q for kw in _TOP_FIRMS_KWS):
+        return "top_firms"
+    if ("last" in user_q or "past" in user_q) and "recall" in user_q:
+        return "time_range"
+    if info.is_firm_total and info.firm_name:
+        return "firm_total"
+    return None
+
+
+def _fallback_result(info: _QuestionInfo, openfda_client: OpenFDAClient) -> Optional[Dict[str, Any]]:
+    """Lightweight fallbacks for common intents with defaults, used when the model did not call a tool."""
+    kind = _fallback_kind(info)
+    # Fallback: "last N recalls"
+    if kind == "last_recalls":
+        n = info.last_n if info.last_n is not None else 10
+        payload = search_recalls_handler(
+            {"limit": n, "sort": "recall_initiation_date:desc"},
+            openfda_client,
+        )
+        count = len(payload.get("recalls", []) or [])
+        answer = f"Last {n} recalls (newest first). Found {count}."
+        return {"answer": answer, "data": payload}
+    # Fallback: list recalls for a specific firm
+    if kind == "firm_list":
+        firm_name = info.firm_name
+        payload = search_recalls_handler(
+            {"firm": firm_name, "limit": 50, "sort": "recall_initiation_date:desc"},
+            openfda_client,
+        )
+        count = len(payload.get("recalls", []) or [])
+        answer = f"Showing {count} recalls for firm {firm_name or ''} (newest first)."
+        return {"answer": answer, "data": payload}
+    # Fallback: only for generic “which firms/top firms/most recalls”
+    if kind == "top_firms":
+        payload = get_recall_stats_handler({"stats": ["topFirms"], "topFirmsLimit": 10}, openfda_client)
+        top = payload.get("topFirms", []) or []
+        if top:
+            lines = [f'{i+1}. {t.get("firm","Unknown")}: {t.get("count",0)}' for i, t in enumerate(top)]
+            answer = "Top firms by recall count:\n" + "\n".join(lines)
+        else:
+            answer = "No firm recall data available."
+        return {"answer": answer, "data": payload}
+    # Time range fallback: last N days/weeks/months → recall_initiation_date range
+    if kind == "time_range":
+        n = info.last_n if info.last_n is not None else 1
+        unit = info.last_unit.rstrip('s')
+        now = datetime.utcnow()
+        if unit in ("day",):
+            start = now - timedelta(days=n)
+        elif unit in ("week",):
+            start = now - timedelta(weeks=n)
+        elif unit in ("month",):
+            # approximate months as 30 days
+            start = now - timedelta(days=30 * n)
+        else:
+            start = now - timedelta(days=n)
+        start_str = start.strftime("%Y%m%d")
+        end_str = now.strftime("%Y%m%d")
+        query = f"recall_initiation_date:[{start_str} TO {end_str}]"
+        payload = search_recalls_handler(
+            {"query": query, "limit": 50, "sort": "recall_initiation_date:desc"},
+            openfda_client,
+        )
+        count = len(payload.get("recalls", []) or [])
+        answer = f"Showing {count} recalls from {start_str} to {end_str}."
+        return {"answer": answer, "data": payload}
+    # Firm total fallback: "how many ... firm <NAME>"
+    if kind == "firm_total":
+        try:
+            firm_name = info.firm_name
+            query = f'recalling_firm:"{firm_name}"'
+            data = openfda_client.search_enforcements(query=query, limit=1, skip=0)
+            meta = (data or {}).get("meta", {})
+            total = int(((meta.get("results") or {}).get("total")) or 0)
+            answer = f"Total recalls for firm {firm_name}: {total}"
+            # Also return a small sample list for context
+            sample_payload = search_recalls_handler({"query": query, "limit": min(10, total), "sort": "recall_initiation_date:desc"}, openfda_client)
+            return {"answer": answer, "data": sample_payload if sample_payload else {"total": total}}
+        except Exception:
+            pass
+    return None
+
+
+async def run_conversation_with_gemini(question: str) -> Dict[str, Any]:
+    chat = _start_chat()
     openfda_client = OpenFDAClient()
     last_tool_payload: Optional[Dict[str, Any]] = None
     max_rounds = 5
 
-    def call_tool(name: str, args: Dict[str, Any]) -> Dict[str, Any]:
-        logger.info(kv("tool_call", name=name, args=args))
-        if name == "search_recalls":
-            return search_recalls_handler(args, openfda_client)
-        if name == "get_recall_stats":
-            return get_recall_stats_handler(args, openfda_client)
-        return {"error": f"Unknown tool: {name}"}
-
     logger.info(kv("question", text=question))
-    response = chat.send_message(question)
+    info = _parse_question(question)
+    response = await chat.send_message_async(question)
     for _ in range(max_rounds):
-        parts = []
-        if response and response.candidates:
-            parts = response.candidates[0].content.parts or []
-        function_calls = [p.function_call for p in parts if getattr(p, "function_call", None)]
+        function_calls = _function_calls(response)
         if function_calls:
-            for fc in function_calls:
-                name = fc.name
-                args = dict(fc.args) if hasattr(fc, "args") else {}
-                # Intercept misrouted calls based on intent and rewrite appropriately
-                uq = (question or "").lower()
-                # map numeric class to label
-                class_label = None
-                if "classification" in uq:
-                    if " 1" in uq or " class 1" in uq or "class i" in uq:
-                        class_label = "Class I"
-                    elif " 2" in uq or " class 2" in uq or "class ii" in uq:
-                        class_label = "Class II"
-                    elif " 3" in uq or " class 3" in uq or "class iii" in uq:
-                        class_label = "Class III"
-                if name == "get_recall_stats" and ("how many" in uq and "firm" in uq):
-                    # try to extract firm name from the question
-                    try:
-                        firm_part = uq.split("firm", 1)[1].strip()
-                        tokens = [t for t in firm_part.split() if t not in ("is", "are", "exists", "for", "of", "the")]
-                        firm_name = " ".join(tokens).strip().strip('"\'' )
-                    except Exception:
-                        firm_name = ""
-                    args = {"stats": ["firmTotal"], "firm": firm_name or (args.get("firm") or "")}
-                    if class_label:
-                        args["classification"] = class_label
-                # least/fewest → bottomFirms (force even if model tried something else)
-                if ("least" in uq) or ("fewest" in uq):
-                    name = "get_recall_stats"
-                    args = {"stats": ["bottomFirms"], "bottomFirmsLimit": 10}
-                    if class_label:
-                        args["classification"] = class_label
-                # If user asked to list recalls for a firm, force search_recalls with firm filter (regex with word boundary)
-                firm_list_match = re.search(r'(?:recalls\s+for\s+firm|list\s+(?:all\s+)?recalls\s+for\s+firm)\s+(.+)', uq)
-                if firm_list_match:
-                    firm_name = firm_list_match.group(1).strip().strip('"\'' )
-                    name = "search_recalls"
-                    args = {"firm": firm_name, "limit": 50, "sort": "recall_initiation_date:desc"}
-                payload = call_tool(name, args)
-                logger.info(kv("tool_result", name=name, keys=list(payload.keys())))
+            calls = [_rewrite_call(info, fc) for fc in function_calls]
+            # openFDA handlers are blocking; run this round's calls concurrently off the event loop
+            payloads = await asyncio.gather(
+                *(asyncio.to_thread(_call_tool, openfda_client, name, args) for name, args in calls)
+            )
+            for (name, _args), payload in zip(calls, payloads):
+                logger.info(kv_ordered("tool_result", (("name", name), ("keys", list(payload.keys())))))
                 last_tool_payload = payload
                 # Send function response back to the model
-                tool_msg = glm_content.Content(
-                    role="tool",
-                    parts=[
-                        glm_content.Part(
-                            function_response=glm_content.FunctionResponse(
-                                name=name,
-                                response=payload,
-                            )
-                        )
-                    ],
-                )
-                response = chat.send_message(tool_msg)
+                response = await chat.send_message_async(_tool_message(name, payload))
             # Continue loop to allow the model to produce a final message
             continue
         # No function call; add lightweight fallbacks for common intents with defaults
         final_text = getattr(response, "text", "") or ""
-        user_q = (question or "").lower()
-        # Fallback: "last N recalls"
-        if ("last" in user_q) and ("recall" in user_q):
-            try:
-                after_last = user_q.split("last", 1)[1].strip()
-                tokens = after_last.split()
-                n = None
-                if tokens and tokens[0].isdigit():
-                    n = int(tokens[0])
-                if n is None:
-                    n = 10
-            except Exception:
-                n = 10
-            payload = search_recalls_handler(
-                {"limit": n, "sort": "recall_initiation_date:desc"},
-                openfda_client,
-            )
-            count = len(payload.get("recalls", []) or [])
-            answer = f"Last {n} recalls (newest first). Found {count}."
-            return {"answer": answer, "data": payload}
-        # Fallback: list recalls for a specific firm
-        if (("list" in user_q or "recalls for firm" in user_q or "list all recalls" in user_q) and "firm" in user_q):
-            try:
-                firm_part = user_q.split("firm", 1)[1].strip()
-                tokens = [t for t in firm_part.split() if t not in ("is", "are", "exists", "for", "of", "the")]
-                firm_name = " ".join(tokens).strip().strip('"\'' )
-            except Exception:
-                firm_name = ""
-            payload = search_recalls_handler(
-                {"firm": firm_name, "limit": 50, "sort": "recall_initiation_date:desc"},
-                openfda_client,
-            )
-            count = len(payload.get("recalls", []) or [])
-            answer = f"Showing {count} recalls for firm {firm_name or ''} (newest first)."
-            return {"answer": answer, "data": payload}
-        # Fallback: only for generic “which firms/top firms/most recalls”
-        if any(kw in user_q for kw in ["which firms", "top firms", "most recalls", "who has the most"]):
-            payload = get_recall_stats_handler({"stats": ["topFirms"], "topFirmsLimit": 10}, openfda_client)
-            top = payload.get("topFirms", []) or []
-            if top:
-                lines = [f'{i+1}. {t.get("firm","Unknown")}: {t.get("count",0)}' for i, t in enumerate(top)]
-                answer = "Top firms by recall count:\n" + "\n".join(lines)
-            else:
-                answer = "No firm recall data available."
-            return {"answer": answer, "data": payload}
-        # Time range fallback: last N days/weeks/months → recall_initiation_date range
-        if ("last" in user_q or "past" in user_q) and "recall" in user_q:
-            # crude parse for "last 1 week(s)/day(s)/month(s)"
-            n = 1
-            if "last" in user_q:
-                try:
-                    after_last = user_q.split("last", 1)[1].strip()
-                    tokens = after_last.split()
-                    if tokens and tokens[0].isdigit():
-                        n = int(tokens[0])
-                        unit = tokens[1] if len(tokens) > 1 else "days"
-                    else:
-                        unit = tokens[0] if tokens else "days"
-                except Exception:
-                    unit = "days"
-            elif "past" in user_q:
-                try:
-                    after_past = user_q.split("past", 1)[1].strip()
-                    tokens = after_past.split()
-                    if tokens and tokens[0].isdigit():
-                        n = int(tokens[0])
-                        unit = tokens[1] if len(tokens) > 1 else "days"
-                    else:
-                        unit = tokens[0] if tokens else "days"
-                except Exception:
-                    unit = "days"
-            unit = unit.rstrip('s')
-            now = datetime.utcnow()
-            if unit in ("day",):
-                start = now - timedelta(days=n)
-            elif unit in ("week",):
-                start = now - timedelta(weeks=n)
-            elif unit in ("month",):
-                # approximate months as 30 days
-                start = now - timedelta(days=30 * n)
-            else:
-                start = now - timedelta(days=n)
-            start_str = start.strftime("%Y%m%d")
-            end_str = now.strftime("%Y%m%d")
-            query = f"recall_initiation_date:[{start_str} TO {end_str}]"
-            payload = search_recalls_handler(
-                {"query": query, "limit": 50, "sort": "recall_initiation_date:desc"},
-                openfda_client,
-            )
-            count = len(payload.get("recalls", []) or [])
-            answer = f"Showing {count} recalls from {start_str} to {end_str}."
-            return {"answer": answer, "data": payload}
-        # Firm total fallback: "how many ... firm <NAME>"
-        if ("how many" in user_q) and ("firm" in user_q):
-            try:
-                # naive extract text after 'firm'
-                firm_part = user_q.split("firm", 1)[1].strip()
-                # remove leading words like 'is', 'are', 'exists', etc.
-                tokens = [t for t in firm_part.split() if t not in ("is", "are", "exists", "for", "of", "the")]
-                # take a reasonable slice, rejoin and uppercase as in dataset
-                firm_name = " ".join(tokens).strip().strip('"\'' )
-                if firm_name:
-                    query = f'recalling_firm:"{firm_name}"'
-                    data = openfda_client.search_enforcements(query=query, limit=1, skip=0)
-                    meta = (data or {}).get("meta", {})
-                    total = int(((meta.get("results") or {}).get("total")) or 0)
-                    answer = f"Total recalls for firm {firm_name}: {total}"
-                    # Also return a small sample list for context
-                    sample_payload = search_recalls_handler({"query": query, "limit": min(10, total), "sort": "recall_initiation_date:desc"}, openfda_client)
-                    return {"answer": answer, "data": sample_payload if sample_payload else {"total": total}}
-            except Exception:
-                pass
+        fallback = await asyncio.to_thread(_fallback_result, info, openfda_client)
+        if fallback is not None:
+            return fallback
         return {"answer": final_text, "data": last_tool_payload}
 
     return {"answer": "Sorry, I could not complete the request.", "data": last_tool_payload}
 
 
+def stream_conversation_with_gemini(question: str) -> Iterator[Dict[str, Any]]:
+    """Same flow as run_conversation_with_gemini, but yields {"token": ...} events as the model
+    writes its answer and ends with a {"done": True, "data": ...} event.
+    """
+    chat = _start_chat()
+    openfda_client = OpenFDAClient()
+    last_tool_payload: Optional[Dict[str, Any]] = None
+    max_rounds = 5
+
+    logger.info(kv("question", text=question, stream=True))
+    info = _parse_question(question)
+    # A fallback replaces the model's text, so only stream it live when none can apply
+    live = _fallback_kind(info) is None
+    response = chat.send_message(question, stream=True)
+    for _ in range(max_rounds):
+        buffered: List[str] = []
+        for chunk in response:
+            text = _chunk_text(chunk)
+            if not text:
+                continue
+            if live:
+                yield {"token": text}
+            else:
+                buffered.append(text)
+        function_calls = _function_calls(response)
+        if function_calls:
+            for fc in function_calls:
+                name, args = _rewrite_call(info, fc)
+                payload = _call_tool(openfda_client, name, args)
+                logger.info(kv_ordered("tool_result", (("name", name), ("keys", list(payload.keys())))))
+                last_tool_payload = payload
+                # The chat refuses a new message until the previous stream is consumed
+                response.resolve()
+                response = chat.send_message(_tool_message(name, payload), stream=True)
+            continue
+        if not live:
+            fallback = _fallback_result(info, openfda_client)
+            if fallback is not None:
+                yield {"token": fallback["answer"]}
+                yield {"done": True, "data": fallback["data"]}
+                return
+            if buffered:
+                yield {"token": "".join(buffered)}
+        yield {"done": True, "data": last_tool_payload}
+        return
+
+    yield {"token": "Sorry, I could not complete the request."}
+    yield {"done": True, "data": last_tool_payload}
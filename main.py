@@ -1,7 +1,9 @@
 from typing import Any
 
 from app.config import get_settings
+from app.responses import ORJSONResponse
 from fastapi import FastAPI
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import FileResponse
 from fastapi.staticfiles import StaticFiles
 from ask.routes import router as ask_router
@@ -10,7 +12,8 @@ from ask.routes import router as ask_router
 settings = get_settings()
 
 
-app = FastAPI(title="OpenFDA Drug Recall Assistant")
+app = FastAPI(title="OpenFDA Drug Recall Assistant", default_response_class=ORJSONResponse)
+app.add_middleware(GZipMiddleware, minimum_size=1024)
 app.mount("/static", StaticFiles(directory="public"), name="static")
 app.include_router(ask_router)
 
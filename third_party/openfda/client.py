@@ -1,18 +1,57 @@
+import threading
 from typing import Any, Dict, List, Optional
 
+import orjson
 import requests
+from cachetools import TTLCache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+def _build_shared_session() -> requests.Session:
+    session = requests.Session()
+    retries = Retry(
+        total=2,
+        backoff_factor=0.2,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False,  # let raise_for_status() surface the final error
+    )
+    session.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=50, max_retries=retries))
+    return session
+
+
+# One process-wide keep-alive pool so TLS to api.fda.gov is reused across requests
+_SHARED_SESSION = _build_shared_session()
+
+# openFDA data changes daily at most; repeated stats/count queries are served from memory.
+# Raw response bodies are stored, so every hit parses a fresh dict that callers may mutate freely.
+_RESPONSE_CACHE: "TTLCache[Any, bytes]" = TTLCache(maxsize=512, ttl=900)
+_RESPONSE_CACHE_LOCK = threading.Lock()
+# Larger search pages are not cached to avoid holding many full result sets
+_MAX_CACHED_SEARCH_LIMIT = 10
 
 
 class OpenFDAClient:
     BASE_URL = "https://api.fda.gov/drug/enforcement.json"
 
     def __init__(self, session: Optional[requests.Session] = None) -> None:
-        self.session = session or requests.Session()
+        self.session = session or _SHARED_SESSION
 
-    def _http_get(self, params: Dict[str, Any]) -> Dict[str, Any]:
+    def _http_get(self, params: Dict[str, Any], use_cache: bool = True) -> Dict[str, Any]:
+        # The cache belongs to the shared session; an injected session always goes to the network
+        key = tuple(sorted(params.items())) if use_cache and self.session is _SHARED_SESSION else None
+        if key is not None:
+            with _RESPONSE_CACHE_LOCK:
+                cached = _RESPONSE_CACHE.get(key)
+            if cached is not None:
+                return orjson.loads(cached)
         response = self.session.get(self.BASE_URL, params=params, timeout=30)
         response.raise_for_status()
-        return response.json()
+        content = response.content
+        if key is not None:
+            with _RESPONSE_CACHE_LOCK:
+                _RESPONSE_CACHE[key] = content
+        return orjson.loads(content)
 
     @staticmethod
     def _compose_search(query: Optional[str], classification: Optional[str]) -> Optional[str]:
@@ -40,10 +79,11 @@ class OpenFDAClient:
             params["search"] = search
         if sort:
             params["sort"] = sort
-        return self._http_get(params)
+        return self._http_get(params, use_cache=limit <= _MAX_CACHED_SEARCH_LIMIT)
 
-    def count_buckets(self, field: str, search: Optional[str] = None) -> List[Dict[str, Any]]:
-        params: Dict[str, Any] = {"count": f"{field}.exact"}
+    def count_buckets(self, field: str, search: Optional[str] = None, exact: bool = True) -> List[Dict[str, Any]]:
+        # Date fields are counted as a {"time", "count"} series and do not take the .exact suffix
+        params: Dict[str, Any] = {"count": f"{field}.exact" if exact else field}
         if search:
             params["search"] = search
         data = self._http_get(params)
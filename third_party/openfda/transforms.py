@@ -1,17 +1,42 @@
-from typing import Any, Dict, List
+from collections import Counter
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+# (output key, openFDA source key, fallback source key) in normalize_recall's key order
+_RECALL_FIELD_SOURCES: Tuple[Tuple[str, str, Optional[str]], ...] = (
+    ("id", "recall_number", None),
+    ("classification", "classification", None),
+    ("productName", "product_description", None),
+    ("firmName", "firm_name", "recalling_firm"),
+    ("status", "status", None),
+    ("recallInitiationDate", "recall_initiation_date", None),
+    ("state", "state", None),
+    ("reasonForRecall", "reason_for_recall", None),
+    ("city", "city", None),
+)
+
+
+def _firm_name(record: Dict[str, Any]) -> Any:
+    # recalling_firm is only a fallback for a missing firm_name key; avoid looking it up eagerly
+    return record["firm_name"] if "firm_name" in record else record.get("recalling_firm")
 
 
 def normalize_recall(record: Dict[str, Any]) -> Dict[str, Any]:
+    get = record.get
     return {
-        "id": record.get("recall_number", "") or "",
-        "classification": record.get("classification", "") or "",
-        "productName": record.get("product_description", "") or "",
-        "firmName": record.get("firm_name", record.get("recalling_firm", "")) or "",
-        "status": record.get("status", "") or "",
-        "recallInitiationDate": record.get("recall_initiation_date", "") or "",
-        "state": record.get("state", "") or "",
-        "reasonForRecall": record.get("reason_for_recall", "") or "",
-        "city": record.get("city", "") or "",
+        key: (_firm_name(record) if fallback else get(source)) or ""
+        for key, source, fallback in _RECALL_FIELD_SOURCES
+    }
+
+
+def normalize_recall_projected(record: Dict[str, Any], field_set: Optional[FrozenSet[str]]) -> Dict[str, Any]:
+    """normalize_recall restricted to field_set, without building the keys that would be dropped."""
+    if field_set is None:
+        return normalize_recall(record)
+    get = record.get
+    return {
+        key: (_firm_name(record) if fallback else get(source)) or ""
+        for key, source, fallback in _RECALL_FIELD_SOURCES
+        if key in field_set
     }
 
 
@@ -22,12 +47,14 @@ def extract_year_from_yyyymmdd(date_yyyymmdd: str) -> str:
 
 
 def group_year_counts(records: List[Dict[str, Any]]) -> Dict[str, int]:
+    return dict(Counter(d[:4] for r in records if len(d := r.get("recall_initiation_date") or "") >= 4))
+
+
+def sum_time_buckets_by_year(buckets: List[Dict[str, Any]]) -> Dict[str, int]:
     counts: Dict[str, int] = {}
-    for r in records:
-        year = extract_year_from_yyyymmdd(r.get("recall_initiation_date", ""))
+    for b in buckets:
+        year = extract_year_from_yyyymmdd(b.get("time", ""))
         if not year:
             continue
-        counts[year] = counts.get(year, 0) + 1
+        counts[year] = counts.get(year, 0) + int(b.get("count", 0) or 0)
     return counts
-
-
@@ -1,78 +1,386 @@
+import atexit
+import copy
+import io
 import json
 import logging
+import logging.handlers
 import os
+import queue
 import sys
-from typing import Any, Dict
+import threading
+import time
+from functools import lru_cache
+from typing import Any, Callable, Dict, Final, Optional, Tuple, Union
 
-_INITIALIZED = False
+import msgspec
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is in requirements, stdlib json is the fallback
+    orjson = None  # type: ignore[assignment]
 
-def _init_root_logger() -> None:
-    global _INITIALIZED
-    if _INITIALIZED:
-        return
-    level_name = os.getenv("LOG_LEVEL", "INFO").upper()
-    level = getattr(logging, level_name, logging.INFO)
+
+def _env_int(name: str, default: int) -> int:
+    # A malformed value falls back to the default, like an unknown LOG_LEVEL does
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# Resolved once at import; the root logger is configured at the bottom of this module
+_LEVEL: Final[int] = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+_FORMAT: Final[str] = os.getenv("LOG_FORMAT", "text").lower()
+_TS_FORMAT: Final[str] = "%Y-%m-%dT%H:%M:%S%z"
+# Bytes of log output held before a write() syscall; <= 0 writes every record straight through
+_BUFFER_BYTES: Final[int] = _env_int("LOG_BUFFER_BYTES", 64 * 1024)
+_FLUSH_INTERVAL_SECONDS: Final[float] = 0.1
+# LOG_QUEUE=0 writes from the calling thread instead of through a QueueListener
+_USE_QUEUE: Final[bool] = os.getenv("LOG_QUEUE", "1") != "0"
+
+# Bound once so the JSON formatter's hot path skips module attribute lookups
+_strftime: Final[Callable[[str, time.struct_time], str]] = time.strftime
+_localtime: Final[Callable[[Optional[float]], time.struct_time]] = time.localtime
+
+# One-slot (second, formatted) cache: the timestamp has one-second resolution, so strftime runs once per second.
+# Racing threads at worst format the same second twice, which is harmless.
+_TS_CACHE: Tuple[int, str] = (-1, "")
+
+
+def _cached_ts(created: float) -> str:
+    global _TS_CACHE
+    sec = int(created)
+    cached = _TS_CACHE
+    if cached[0] != sec:
+        cached = _TS_CACHE = (sec, _strftime(_TS_FORMAT, _localtime(sec)))
+    return cached[1]
+
+
+def _dumps(obj: Any) -> str:
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def _dumps_fields(obj: Any, sort_keys: bool = True) -> str:
+    """Key-value dump for kv_message; tolerant of custom objects via _safe_default."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS if sort_keys else orjson.OPT_NON_STR_KEYS
+        return orjson.dumps(obj, default=_safe_default, option=option).decode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, sort_keys=sort_keys, default=_safe_default)
+
+
+def _init_root_logger() -> bool:
+    # None of our formats print thread/process/task names; stop LogRecord.__init__ from looking them up
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    if hasattr(logging, "logAsyncioTasks"):  # Python 3.12+
+        logging.logAsyncioTasks = False
 
     root = logging.getLogger()
-    root.setLevel(level)
+    root.setLevel(_LEVEL)
 
     # Clear existing handlers to avoid duplicate logs when reloaded
     root.handlers.clear()
 
-    handler = logging.StreamHandler(stream=sys.stdout)
-    fmt = os.getenv("LOG_FORMAT", "text").lower()
-    if fmt == "json":
-        formatter = _JsonFormatter()
+    # Handlers stay at NOTSET. Logger.isEnabledFor already drops sub-threshold records before a LogRecord or
+    # any formatting exists, and a handler level would also drop records from loggers set below LOG_LEVEL.
+    handler = _make_stdout_handler()
+    if not _USE_QUEUE:
+        root.addHandler(handler)
+        return True
+
+    # Callers only enqueue records; a background listener thread formats and writes them
+    queue_handler = _QueueHandler(queue.SimpleQueue())
+    root.addHandler(queue_handler)
+    listener = _start_listener(queue_handler, handler)
+
+    def restart_listener_in_child() -> None:
+        # Threads do not survive fork(); a pre-forked worker (e.g. gunicorn --preload) needs its own listener
+        nonlocal listener
+        atexit.unregister(listener.stop)
+        listener = _start_listener(queue_handler, handler)
+
+    if hasattr(os, "register_at_fork"):  # POSIX only
+        os.register_at_fork(after_in_child=restart_listener_in_child)
+    return True
+
+
+def _start_listener(queue_handler: logging.handlers.QueueHandler, handler: logging.Handler) -> logging.handlers.QueueListener:
+    log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+    queue_handler.queue = log_queue
+    listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    listener.start()
+    # stop() drains what is still queued before the interpreter exits
+    atexit.register(listener.stop)
+    return listener
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves exception and stack info on the record for the listener's formatter."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() folds the traceback into msg and clears exc_info, which would put it inside the
+        # JSON "message". Only msg % args is resolved here, since args may be mutated after the call returns.
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        return record
+
+
+class _BufferedStreamHandler(logging.StreamHandler):
+    """StreamHandler without the per-record flush; a background thread flushes shortly after each burst."""
+
+    def __init__(self, stream: Any, buffered: bool = True) -> None:
+        super().__init__(stream)
+        # An unbuffered stream has nothing to flush, so it gets no flusher thread
+        self._pending: Optional[threading.Event] = None
+        if not buffered:
+            return
+        self._start_flusher()
+        if hasattr(os, "register_at_fork"):  # POSIX only
+            # Threads do not survive fork(); a pre-forked worker (e.g. gunicorn --preload) needs its own flusher.
+            # Flushing first keeps the child from inheriting, and later re-writing, the parent's buffered lines.
+            os.register_at_fork(before=self.flush, after_in_child=self._start_flusher)
+
+    def _start_flusher(self) -> None:
+        self._pending = threading.Event()
+        threading.Thread(target=self._flush_loop, args=(self._pending,), name="log-flusher", daemon=True).start()
+
+    def _flush_loop(self, pending: threading.Event) -> None:
+        while True:
+            # Idle until emit() writes something, then let the rest of the burst land before one flush
+            pending.wait()
+            time.sleep(_FLUSH_INTERVAL_SECONDS)
+            pending.clear()
+            self.flush()
+
+    def _mark_pending(self) -> None:
+        pending = self._pending
+        if pending is not None and not pending.is_set():
+            pending.set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+            self._mark_pending()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class _BytesStreamHandler(_BufferedStreamHandler):
+    """Writes the bytes produced by _BytesJsonFormatter straight to a binary stream, no str round-trip."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            self.stream.write(self.format(record) + b"\n")  # type: ignore[operator]
+            self._mark_pending()
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+class _FastJsonHandler(logging.Handler):
+    """Unlocked handler for JSON bytes without the queue: each record is one os.write() of a complete line.
+
+    Writes up to PIPE_BUF bytes are atomic, so concurrent records never interleave below that size. Larger
+    records from different threads can; use the default QueueListener path when that matters.
+    """
+
+    def __init__(self, fd: int) -> None:
+        super().__init__()
+        self.fd = fd
+
+    def handle(self, record: logging.LogRecord) -> Any:
+        # Handler.handle minus the lock acquire/release around emit()
+        rv = self.filter(record)
+        if rv:
+            self.emit(rv if isinstance(rv, logging.LogRecord) else record)
+        return rv
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            line: bytes = self.format(record)  # type: ignore[assignment]
+            view = memoryview(line + b"\n")
+            # os.write may write only part of the buffer (pipes, sockets, EINTR); keep going until it is all out
+            while view:
+                try:
+                    view = view[os.write(self.fd, view):]
+                except BlockingIOError:
+                    # Non-blocking stdout is full; back off briefly instead of dropping the record
+                    time.sleep(0.001)
+        except RecursionError:
+            raise
+        except Exception:
+            self.handleError(record)
+
+
+def _make_stdout_handler() -> logging.Handler:
+    try:
+        fd = sys.stdout.fileno()
+        # Own FileIO on fd 1 (closefd=False) so closing or collecting this wrapper never closes sys.stdout
+        raw = io.FileIO(fd, "wb", closefd=False)
+    except (AttributeError, OSError, ValueError):
+        # stdout replaced by something without a real fd (e.g. captured in tests)
+        plain = logging.StreamHandler(stream=sys.stdout)
+        plain.setFormatter(_JSON_FORMATTER if _FORMAT == "json" else _TEXT_FORMATTER)
+        return plain
+    if not _USE_QUEUE and _FORMAT == "json" and orjson is not None:
+        fast = _FastJsonHandler(fd)
+        fast.setFormatter(_BYTES_JSON_FORMATTER)
+        return fast
+    buffered = _BUFFER_BYTES > 0
+    binary: Any = io.BufferedWriter(raw, buffer_size=_BUFFER_BYTES) if buffered else raw
+    handler: logging.StreamHandler
+    if _FORMAT == "json" and orjson is not None:
+        handler = _BytesStreamHandler(stream=binary, buffered=buffered)
+        handler.setFormatter(_BYTES_JSON_FORMATTER)
     else:
-        formatter = logging.Formatter(
-            fmt="%(asctime)s %(levelname)s %(name)s - %(message)s",
-            datefmt="%Y-%m-%dT%H:%M:%S%z",
-        )
-    handler.setFormatter(formatter)
-    root.addHandler(handler)
-    _INITIALIZED = True
+        handler = _BufferedStreamHandler(stream=io.TextIOWrapper(binary, encoding="utf-8", write_through=not buffered), buffered=buffered)
+        handler.setFormatter(_JSON_FORMATTER if _FORMAT == "json" else _TEXT_FORMATTER)
+    return handler
+
+
+_EMPTY_PROPS: Final[Dict[str, Any]] = {}
 
 
 class _JsonFormatter(logging.Formatter):
-    def format(self, record: logging.LogRecord) -> str:
-        payload: Dict[str, Any] = {
-            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S%z"),
-            "level": record.levelname,
-            "logger": record.name,
-            "message": record.getMessage(),
+    def _payload(self, record: logging.LogRecord) -> Dict[str, Any]:
+        d = record.__dict__
+        # Plain-string messages without args (always the case after QueueHandler.prepare) skip getMessage
+        msg = d["msg"]
+        if d["args"] or msg.__class__ is not str:
+            msg = record.getMessage()
+        # Extra props (record.__dict__["props"]) are merged in; a non-mapping props is a caller bug and raises
+        payload = {
+            "ts": _cached_ts(d["created"]),
+            "level": d["levelname"],
+            "logger": d["name"],
+            "message": msg,
+            **(d.get("props") or _EMPTY_PROPS),
         }
-        # If extra props were provided via record.__dict__["props"]
-        props = getattr(record, "props", None)
-        if isinstance(props, dict) and props:
-            payload.update(props)
-        return json.dumps(payload, ensure_ascii=False)
+        if d["exc_info"] or d["exc_text"] or d["stack_info"]:
+            self._add_exception(record, payload)
+        return payload
+
+    def _add_exception(self, record: logging.LogRecord, payload: Dict[str, Any]) -> None:
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            payload["exception"] = record.exc_text
+        if record.stack_info:
+            payload["stack"] = self.formatStack(record.stack_info)
+
+    def format(self, record: logging.LogRecord) -> str:
+        return _dumps(self._payload(record))
+
+
+class _LogPayload(msgspec.Struct):
+    """Fixed schema for records without props; msgspec encodes it without per-key dict work."""
+
+    ts: str
+    level: str
+    logger: str
+    message: str
+
+
+_encode_log_payload: Final[Callable[[_LogPayload], bytes]] = msgspec.json.Encoder().encode
+
+
+class _BytesJsonFormatter(_JsonFormatter):
+    """orjson's UTF-8 bytes are kept as-is for _BytesStreamHandler; decoding to str would waste the win."""
 
+    def format(self, record: logging.LogRecord) -> bytes:  # type: ignore[override]
+        d = record.__dict__
+        # The fixed four-key shape only; props, tracebacks and stack info take the dict path
+        if not (d.get("props") or d["exc_info"] or d["exc_text"] or d["stack_info"]):
+            msg = d["msg"]
+            if d["args"] or msg.__class__ is not str:
+                msg = record.getMessage()
+            return _encode_log_payload(_LogPayload(_cached_ts(d["created"]), d["levelname"], d["name"], msg))
+        return orjson.dumps(self._payload(record), option=orjson.OPT_NON_STR_KEYS)
 
+
+class _TextFormatter(logging.Formatter):
+    """Builds the 'ts LEVEL name - message' line directly; logging.Formatter only handles tracebacks."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        if record.exc_info or record.exc_text or record.stack_info:
+            return super().format(record)
+        msg = record.msg
+        if record.args or msg.__class__ is not str:
+            msg = record.getMessage()
+        return f"{_cached_ts(record.created)} {record.levelname} {record.name} - {msg}"
+
+
+_TEXT_FORMATTER: Final[logging.Formatter] = _TextFormatter(
+    fmt="%(asctime)s %(levelname)s %(name)s - %(message)s",
+    datefmt=_TS_FORMAT,
+)
+_JSON_FORMATTER: Final[logging.Formatter] = _JsonFormatter()
+_BYTES_JSON_FORMATTER: Final[logging.Formatter] = _BytesJsonFormatter()
+
+
+@lru_cache(maxsize=1024)
 def get_logger(name: str) -> logging.Logger:
-    _init_root_logger()
+    """Loggers are process-global, so repeat lookups skip the logging module lock.
+    Pass the module's __name__ so the cache key is an already-interned string.
+    """
     return logging.getLogger(name)
 
 
-def kv_message(message: str, **fields: Any) -> str:
+class _KVMessage:
+    """Log message whose key-value JSON is rendered only when the record is actually formatted."""
+
+    __slots__ = ("message", "fields", "sort_keys")
+    message: str
+    fields: Dict[str, Any]
+    sort_keys: bool
+
+    def __init__(self, message: str, fields: Dict[str, Any], sort_keys: bool = True) -> None:
+        self.message = message
+        self.fields = fields
+        self.sort_keys = sort_keys
+
+    def __str__(self) -> str:
+        return f"{self.message} | {_dumps_fields(self.fields, self.sort_keys)}"
+
+
+# Keep log calls lazy: pass kv_message(...) or %-style args, never an f-string (ruff's G004 catches those).
+def kv_message(message: str, **fields: Any) -> Union[str, _KVMessage]:
     """Return message with appended JSON key-values for quick, readable context.
     Uses a permissive serializer so proto/RepeatedComposite and other custom objects won't crash logging.
+    Serialization is deferred to LogRecord.getMessage, so records below the level cost nothing.
+    """
+    if not fields:
+        return message
+    return _KVMessage(message, fields)
+
+
+def kv_message_ordered(message: str, fields: Tuple[Tuple[str, Any], ...]) -> Union[str, _KVMessage]:
+    """kv_message for callers that already pass (key, value) pairs in the order they want logged.
+    Keys are emitted in the given order, skipping the per-call sort; prefer this on hot paths.
     """
     if not fields:
         return message
-    return f"{message} | {json.dumps(fields, ensure_ascii=False, sort_keys=True, default=_safe_default)}"
+    return _KVMessage(message, dict(fields), sort_keys=False)
 
 
-def _safe_default(obj: Any) -> str:
+def _safe_default(obj: Any) -> Any:
     try:
         # Prefer object's dict-like view if available
         if hasattr(obj, "to_dict"):
-            return obj.to_dict()  # type: ignore[return-value]
+            return obj.to_dict()
         if isinstance(obj, (set,)):
-            return list(obj)  # type: ignore[return-value]
+            return list(obj)
         # Fallback to string representation
         return str(obj)
     except Exception:
         return repr(obj)
 
 
+_INITIALIZED: Final[bool] = _init_root_logger()